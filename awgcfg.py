@@ -5,6 +5,7 @@ import subprocess
 import optparse
 import random
 import datetime
+import time
 
 g_main_config_src = '.main.config'
 g_main_config_fn = None
@@ -24,6 +25,10 @@ parser.add_option("-p", "--port", dest="port", default=None, type='int')
 parser.add_option("", "--make", dest="makecfg", default="")
 parser.add_option("", "--tun", dest="tun", default="")
 parser.add_option("", "--create", dest="create", action="store_true", default=False)
+parser.add_option("", "--rotate", dest="rotate", action="store_true", default=False)
+parser.add_option("", "--max-age", dest="max_age", default=90, type='int')
+parser.add_option("", "--wave", dest="wave", default=10, type='int')
+parser.add_option("", "--wave-delay", dest="wave_delay", default=60, type='int')
 (opt, args) = parser.parse_args()
 
 g_defserver_config = """
@@ -282,6 +287,7 @@ class WGConfig():
             if line.startswith('#_'):
                 line_prefix = "#_"
             self.lines[nline] = f'{line_prefix}{param_name} = {param_value}'
+            client[param_name] = param_value
             return
 
         if not force:
@@ -298,14 +304,30 @@ class WGConfig():
             if v >= pos:
                 self.idsline[k] = v + 1
 
+        for item in [self.iface] + list(self.peer.values()):
+            if item is client:
+                item['_lines_range'] = (min_line, max_line + 1)
+                continue
+            i_min, i_max = item['_lines_range']
+            if i_min >= pos:
+                item['_lines_range'] = (i_min + 1, i_max + 1)
+
         self.idsline[f'{c_name}|{param_name}'] = pos
         self.lines.insert(pos, new_line)
         return
 
-def exec_cmd(cmd, input=None, shell=True, check=True, timeout=None):
+    def update_keys(self, c_name):
+        priv_key, pub_key = gen_pair_keys()
+        self.set_param(c_name, '_PrivateKey', priv_key, force=True, offset=2)
+        self.set_param(c_name, 'PublicKey', pub_key)
+        gentime = datetime.datetime.now().isoformat()
+        self.set_param(c_name, '_GenKeyTime', gentime, force=True, offset=2)
+        return self.peer[c_name]['AllowedIPs']
+
+def exec_cmd(cmd, input=None, shell=True, check=True, timeout=None, stderr=subprocess.STDOUT):
     proc = subprocess.run(cmd, input=input, shell=shell, check=check,
                           timeout=timeout, encoding='utf8',
-                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                          stdout=subprocess.PIPE, stderr=stderr)
     rc = proc.returncode
     out = proc.stdout
     return rc, out
@@ -362,6 +384,73 @@ def gen_pair_keys(cfg_type=None):
 
     return priv_key, pub_key
 
+def get_tun_name():
+    if opt.tun:
+        return opt.tun
+    cfg_name = os.path.basename(g_main_config_fn)
+    return os.path.splitext(cfg_name)[0].strip()
+
+def tun_iface_exists():
+    if sys.platform == 'win32':
+        return False
+
+    rc, out = exec_cmd(f'ip link show {get_tun_name()}', check=False)
+    return rc == 0
+
+def sync_tun_iface(cfg_type=None):
+    if not cfg_type:
+        cfg_type = g_main_config_type
+
+    tun_name = get_tun_name()
+    wgtool = cfg_type.lower()
+    rc, out = exec_cmd(f'{wgtool}-quick strip {g_main_config_fn}', check=False, stderr=subprocess.PIPE)
+    if rc:
+        raise RuntimeError(f'ERROR: Cannot strip config "{g_main_config_fn}"')
+
+    rc, out = exec_cmd(f'{wgtool} syncconf {tun_name} /dev/stdin', input=out, check=False)
+    if rc:
+        raise RuntimeError(f'ERROR: Cannot sync tunnel iface "{tun_name}": {out.strip()}')
+
+    return True
+
+def get_key_age(peer, now=None):
+    if not now:
+        now = datetime.datetime.now()
+    if 'GenKeyTime' not in peer:
+        return None
+    try:
+        gentime = datetime.datetime.fromisoformat(peer['GenKeyTime'])
+    except ValueError:
+        return None
+    if gentime.tzinfo:
+        gentime = gentime.astimezone().replace(tzinfo=None)
+    return now - gentime
+
+def need_key_rotation(peer, max_age, now=None):
+    age = get_key_age(peer, now)
+    return age is None or age >= max_age
+
+def make_client_config(tmpcfg, srv, peer):
+    out = tmpcfg[:]
+    out = out.replace('<CLIENT_PRIVATE_KEY>', peer['PrivateKey'])
+    out = out.replace('<CLIENT_PUBLIC_KEY>', peer['PublicKey'])
+    out = out.replace('<CLIENT_TUNNEL_IP>', peer['AllowedIPs'])
+    if g_main_config_type == 'AWG':
+        if 'Jc' not in srv or 'Jmin' not in srv or 'Jmax' not in srv:
+            raise RuntimeError('ERROR: AWG server config has no Jc/Jmin/Jmax in [Interface]')
+        out = out.replace('<JC>', srv['Jc'])
+        out = out.replace('<JMIN>', srv['Jmin'])
+        out = out.replace('<JMAX>', srv['Jmax'])
+    out = out.replace('<S1>', srv['S1'])
+    out = out.replace('<S2>', srv['S2'])
+    out = out.replace('<H1>', srv['H1'])
+    out = out.replace('<H2>', srv['H2'])
+    out = out.replace('<H3>', srv['H3'])
+    out = out.replace('<H4>', srv['H4'])
+    out = out.replace('<SERVER_PORT>', srv['ListenPort'])
+    out = out.replace('<SERVER_PUBLIC_KEY>', srv['PublicKey'])
+    return out
+
 def get_main_config_path(check=True):
     global g_main_config_fn
     global g_main_config_type
@@ -409,12 +498,7 @@ if opt.makecfg:
     if not ipaddr.mask:
         raise RuntimeError(f'ERROR: Incorrect argument ipaddr = "{opt.ipaddr}"')
 
-    if opt.tun:
-        tun_name = opt.tun
-    else:
-        cfg_name = os.path.basename(g_main_config_fn)
-        tun_name = os.path.splitext(cfg_name)[0].strip()
-
+    tun_name = get_tun_name()
     print(f'Tunnel iface: "{tun_name}"')
 
     priv_key, pub_key = gen_pair_keys(m_cfg_type)
@@ -504,7 +588,7 @@ if opt.create:
     print(f'Template client config file "{opt.tmpcfg}" created!')
     sys.exit(0)
 
-xopt = [opt.addcl, opt.update, opt.delete]
+xopt = [opt.addcl, opt.update, opt.delete, 'rotate' if opt.rotate else '']
 copt = [x for x in xopt if len(x) > 0]
 if copt and len(copt) >= 2:
     raise RuntimeError(f'ERROR: Incorrect arguments! Too many actions!')
@@ -570,15 +654,94 @@ if opt.update:
     cfg = WGConfig(g_main_config_fn)
     p_name = opt.update
     print(f'Update keys for client "{p_name}"...')
-    priv_key, pub_key = gen_pair_keys()
-    cfg.set_param(p_name, '_PrivateKey', priv_key, force=True, offset=2)
-    cfg.set_param(p_name, 'PublicKey', pub_key)
-    gentime = datetime.datetime.now().isoformat()
-    cfg.set_param(p_name, '_GenKeyTime', gentime, force=True, offset=2)
-    ipaddr = cfg.peer[p_name]['AllowedIPs']
+    ipaddr = cfg.update_keys(p_name)
     cfg.save()
     print(f'Keys for client "{p_name}" updated! IP-Addr: "{ipaddr}"')
 
+if opt.rotate:
+    if opt.max_age < 0:
+        raise RuntimeError(f'ERROR: Incorrect argument max-age = {opt.max_age}')
+    if opt.wave <= 0:
+        raise RuntimeError(f'ERROR: Incorrect argument wave = {opt.wave}')
+    if opt.wave_delay < 0:
+        raise RuntimeError(f'ERROR: Incorrect argument wave-delay = {opt.wave_delay}')
+
+    if not os.path.exists(opt.tmpcfg):
+        raise RuntimeError(f'ERROR: file "{opt.tmpcfg}" not found!')
+
+    with open(opt.tmpcfg, 'r') as file:
+        tmpcfg = file.read()
+
+    cfg = WGConfig(g_main_config_fn)
+    print(f'Rotate keys older than {opt.max_age} days...')
+    max_age = datetime.timedelta(days=opt.max_age)
+    now = datetime.datetime.now()
+    rotlist = []
+    for peer_name, peer in cfg.peer.items():
+        if 'Name' not in peer or 'PrivateKey' not in peer:
+            print(f'Skip peer with pubkey "{peer["PublicKey"]}"')
+            continue
+        if not need_key_rotation(peer, max_age, now):
+            continue
+        age = get_key_age(peer, now)
+        if age is None:
+            age = datetime.timedelta.max
+        rotlist.append((age, peer_name))
+
+    rotlist.sort(key=lambda x: x[0], reverse=True)
+    rotlist = [peer_name for age, peer_name in rotlist]
+    waves = [rotlist[i:i+opt.wave] for i in range(0, len(rotlist), opt.wave)]
+
+    wave_delay = opt.wave_delay
+    live_sync = tun_iface_exists()
+    if waves and not live_sync:
+        print(f'WARNING: Tunnel iface "{get_tun_name()}" not found! Live update is impossible, waves are applied without delay.')
+        wave_delay = 0
+
+    print(f'Found {len(rotlist)} client(s) for rotation, waves: {len(waves)} (size = {opt.wave}, delay = {wave_delay} sec)')
+
+    if waves:
+        import qrcode
+        # check server params and template before any key is changed
+        make_client_config(tmpcfg, cfg.iface, cfg.peer[rotlist[0]])
+
+    rotated = []
+    for n, wave in enumerate(waves):
+        if n > 0 and wave_delay > 0:
+            print(f'Wait {wave_delay} sec before next wave...')
+            time.sleep(wave_delay)
+
+        # the server config may be changed by other commands during the pause
+        cfg = WGConfig(g_main_config_fn)
+        wave = [p_name for p_name in wave if p_name in cfg.peer and need_key_rotation(cfg.peer[p_name], max_age, now)]
+        if not wave:
+            print(f'Wave {n+1}/{len(waves)}: no clients left, skip')
+            continue
+
+        print(f'Wave {n+1}/{len(waves)}: {", ".join(wave)}')
+        try:
+            for p_name in wave:
+                cfg.update_keys(p_name)
+            cfg.save()
+            rotated += wave
+            for p_name in wave:
+                out = make_client_config(tmpcfg, cfg.iface, cfg.peer[p_name])
+                with open(f'{p_name}.conf', 'w', newline='\n') as file:
+                    file.write(out)
+                img = qrcode.make(out)
+                img.save(f'{p_name}.png')
+            if live_sync:
+                sync_tun_iface()
+        except Exception:
+            if rotated:
+                print(f'Keys rotated for client(s): {", ".join(rotated)}')
+                print(f'Client files or tunnel iface "{get_tun_name()}" may be outdated. Run regen and restart the service!')
+            raise
+
+    print(f'Keys for {len(rotated)} client(s) rotated!')
+    if rotated and not live_sync:
+        print(f'WARNING: Restart the service to apply new keys!')
+
 if opt.delete:
     cfg = WGConfig(g_main_config_fn)
     p_name = opt.delete
@@ -610,36 +773,11 @@ if opt.confgen:
         if os.path.exists(fn):
             os.remove(fn)
 
-    jc_srv = None
-    jmin_srv = None
-    jmax_srv = None
-    if g_main_config_type == 'AWG':
-        if 'Jc' not in srv or 'Jmin' not in srv or 'Jmax' not in srv:
-            raise RuntimeError('ERROR: AWG server config has no Jc/Jmin/Jmax in [Interface]')
-        jc_srv = srv['Jc']
-        jmin_srv = srv['Jmin']
-        jmax_srv = srv['Jmax']
-
     for peer_name, peer in cfg.peer.items():
         if 'Name' not in peer or 'PrivateKey' not in peer:
             print(f'Skip peer with pubkey "{peer["PublicKey"]}"')
             continue
-        out = tmpcfg[:]
-        out = out.replace('<CLIENT_PRIVATE_KEY>', peer['PrivateKey'])
-        out = out.replace('<CLIENT_PUBLIC_KEY>', peer['PublicKey'])
-        out = out.replace('<CLIENT_TUNNEL_IP>', peer['AllowedIPs'])
-        if g_main_config_type == 'AWG':
-            out = out.replace('<JC>', str(jc_srv))
-            out = out.replace('<JMIN>', str(jmin_srv))
-            out = out.replace('<JMAX>', str(jmax_srv))
-        out = out.replace('<S1>', srv['S1'])
-        out = out.replace('<S2>', srv['S2'])
-        out = out.replace('<H1>', srv['H1'])
-        out = out.replace('<H2>', srv['H2'])
-        out = out.replace('<H3>', srv['H3'])
-        out = out.replace('<H4>', srv['H4'])
-        out = out.replace('<SERVER_PORT>', srv['ListenPort'])
-        out = out.replace('<SERVER_PUBLIC_KEY>', srv['PublicKey'])
+        out = make_client_config(tmpcfg, srv, peer)
         fn = f'{peer_name}.conf'
         with open(fn, 'w', newline='\n') as file:
             file.write(out)
@@ -88,7 +88,7 @@ list_clients() {
 usage() {
     exec >&2; echo ""; echo "Скрипт управления AmneziaWG (v3.0)"; echo "=============================================="; echo "Использование: $0 [ОПЦИИ] <КОМАНДА> [АРГУМЕНТЫ]"; echo "";
     echo "Опции:"; echo "  -h, --help            Показать эту справку"; echo "  -v, --verbose         Расширенный вывод (для команды list)"; echo "  --no-color            Отключить цветной вывод"; echo "  --conf-dir=ПУТЬ       Указать директорию AWG (умолч: $AWG_DIR)"; echo "  --server-conf=ПУТЬ    Указать файл конфига сервера (умолч: $SERVER_CONF_FILE)"; echo "";
-    echo "Команды:"; echo "  add <имя>             Добавить клиента"; echo "  remove <имя>          Удалить клиента"; echo "  list [-v]             Показать список клиентов"; echo "  regen [имя]           Перегенерировать файлы клиента(ов)"; echo "  modify <имя> <пар> <зн> Изменить параметр клиента";
+    echo "Команды:"; echo "  add <имя>             Добавить клиента"; echo "  remove <имя>          Удалить клиента"; echo "  list [-v]             Показать список клиентов"; echo "  regen [имя]           Перегенерировать файлы клиента(ов)"; echo "  modify <имя> <пар> <зн> Изменить параметр клиента"; echo "  rotate [дни] [N] [сек] Ротация ключей старше [дни] волнами по N клиентов";
     echo "  backup                Создать бэкап"; echo "  restore [файл]        Восстановить из бэкапа"; echo "  check | status        Проверить состояние сервера"; echo "  show                  Показать статус \`awg show\`"; echo "  restart               Перезапустить сервис AmneziaWG"; echo "  help                  Показать эту справку"; echo "";
     echo "ВАЖНО: Перезапустите сервис после 'add', 'remove', 'restore':"; echo "  sudo systemctl restart awg-quick@awg0 (или $0 restart)"; echo ""; exit 1;
 }
@@ -150,6 +150,20 @@ case $COMMAND in
             log_error "Ошибка перегенерации файлов клиентов.";
         fi
         ;;
+    rotate)
+        max_age="${ARGS[0]:-90}"; wave="${ARGS[1]:-10}"; wave_delay="${ARGS[2]:-60}";
+        for v in "$max_age" "$wave" "$wave_delay"; do if ! [[ "$v" =~ ^[0-9]+$ ]]; then die "Использование: rotate [дни] [размер_волны] [пауза_сек]"; fi; done
+        if [ "$wave" -lt 1 ]; then die "Использование: rotate [дни] [размер_волны] [пауза_сек] (размер_волны >= 1)"; fi
+        if ! confirm_action "обновить" "ключи клиентов старше $max_age дн."; then exit 1; fi
+        backup_configs
+        log "Ротация ключей (возраст >= $max_age дн., волна: $wave, пауза: $wave_delay сек)...";
+        if run_awgcfg --rotate --max-age "$max_age" --wave "$wave" --wave-delay "$wave_delay"; then
+            log "Ротация завершена. Передайте клиентам обновленные файлы .conf/.png.";
+            if ! ip link show awg0 &>/dev/null; then log_warn "Интерфейс awg0 не запущен: требуется перезапуск сервиса: sudo systemctl restart awg-quick@awg0"; fi
+        else
+            log_error "Ошибка ротации ключей. Файлы уже обновленных клиентов записаны; при необходимости выполните '$0 regen' и перезапустите сервис: sudo systemctl restart awg-quick@awg0";
+        fi
+        ;;
     modify)   modify_client "$CLIENT_NAME" "$PARAM" "$VALUE" ;;
     backup)   backup_configs ;;
     restore)  restore_backup "$CLIENT_NAME" ;; # Используем CLIENT_NAME как [файл]